@@ -1,16 +1,19 @@
-from urllib import request
 import logging
+import os
+import socket
 import sys
 from pathlib import Path
 
 EXE_FILE_NAME = 'HD2_SabreSquadron.exe'
+GITHUB_API_HOST = ('api.github.com', 443)
 
 
 def check_internet_connection() -> None:
-    """Check if there is an active internet connection."""
+    """Check if there is an active internet connection to GitHub."""
     try:
-        request.urlopen('http://google.com', timeout=1)
-    except request.URLError:
+        # Достаточно открыть TCP соединение, HTTP запрос не нужен
+        socket.create_connection(GITHUB_API_HOST, timeout=1).close()
+    except OSError:
         msg = "No internet connection."
         print(msg)
         logging.error(msg)
@@ -57,12 +60,9 @@ def delete_empty_folders(folder_path):
     if not folder.is_dir():
         raise ValueError(f"{folder_path} is not a valid directory.")
 
-    # Recursively check all subdirectories
-    for item in folder.iterdir():
-        if item.is_dir():
-            # Recursively clean subdirectory
-            delete_empty_folders(item)
-
-    # Delete folder if it's empty after cleaning subdirectories
-    if not any(folder.iterdir()):  # Check if the folder is now empty
-        folder.rmdir()  # Delete the empty folder
+    # Walk bottom-up, so nested folders are deleted before their parents are checked
+    for root, _, _ in os.walk(folder, topdown=False):
+        with os.scandir(root) as it:
+            is_empty = next(it, None) is None
+        if is_empty:
+            os.rmdir(root)  # Delete the empty folder
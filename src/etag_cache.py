@@ -0,0 +1,49 @@
+from src.json_cache import JsonCache
+
+ETAG_CACHE_FILE = 'etag_cache.json'
+
+# url -> {'etag': str, 'data': dict | list}
+_cache = JsonCache(ETAG_CACHE_FILE, 'ETag cache')
+
+
+def load_etag(url: str) -> tuple:
+    """
+    Get ETag and JSON content of the last successful response for the URL.
+
+    Parameters
+    ----------
+    url : str
+        Requested URL.
+
+    Returns
+    -------
+    tuple: (etag, data)
+        (None, None) if the URL was never cached.
+    """
+    entry = _cache.get(url)
+    if entry is None:
+        return None, None
+    return entry['etag'], entry['data']
+
+
+def store_etag(url: str, etag: str, data: dict | list) -> None:
+    """
+    Remember ETag and JSON content of the response for the URL.
+
+    Parameters
+    ----------
+    url : str
+        Requested URL.
+    etag : str
+        'ETag' response header.
+    data : dict or list
+        The JSON content of the response.
+    """
+    _cache.set(url, {'etag': etag, 'data': data})
+
+
+def save_etag_cache() -> None:
+    """
+    Write the ETag cache to disk.
+    """
+    _cache.save()
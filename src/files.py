@@ -1,37 +1,268 @@
 import asyncio
+import functools
+import hashlib
 import logging
-from pathlib import Path
+import os
+import shutil
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable
 
-import aiofiles
 import aiohttp
 from tqdm import tqdm
 
+from src.hash_cache import store_sha1
+from src.local_version import USER_AGENT
 
-async def download_files(session: aiohttp.ClientSession, files_to_download: list) -> None:
+try:
+    import h2  # pylint: disable=unused-import
+    import httpx
+except ImportError:
+    httpx = None
+
+# Число одновременных загрузок можно уменьшить на медленном канале
+MAX_CONCURRENT_DOWNLOADS = 32
+MAX_CONCURRENCY_ENV = 'HD2_MAX_CONCURRENCY'
+H2_MAX_CONNECTIONS = 8
+CHUNK_SIZE = 256 * 1024  # Размер куска данных для загрузки
+READ_BUFFER_SIZE = 1 << 20  # Буфер чтения ответа aiohttp (по умолчанию 64 КиБ)
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+# Без O_BINARY Windows преобразует переводы строк при записи
+O_BINARY = getattr(os, 'O_BINARY', 0)
+
+
+def get_max_concurrent_downloads() -> int:
+    """
+    Get number of files downloaded at the same time.
+
+    Returns
+    -------
+    int
+        Value of HD2_MAX_CONCURRENCY environment variable if it is a positive integer,
+        otherwise MAX_CONCURRENT_DOWNLOADS.
+    """
+    value = os.environ.get(MAX_CONCURRENCY_ENV)
+    if value is None:
+        return MAX_CONCURRENT_DOWNLOADS
+    try:
+        max_concurrent = int(value)
+    except ValueError:
+        max_concurrent = 0
+    if max_concurrent < 1:
+        logging.warning("Invalid %s=%r, using %d.", MAX_CONCURRENCY_ENV, value,
+                        MAX_CONCURRENT_DOWNLOADS)
+        return MAX_CONCURRENT_DOWNLOADS
+    return max_concurrent
+
+
+@dataclass(slots=True)
+class DownloadTask:
+    """
+    File to download.
+
+    Attributes
+    ----------
+    download_url : str
+        Raw URL of the file.
+    local_path : str
+        The destination path to save the file.
+    size : int
+        File size in bytes from the GitHub API tree.
+    sha : str
+        Git blob SHA1 of the file.
+    """
+    download_url: str
+    local_path: str
+    size: int
+    sha: str
+
+
+async def download_while_scanning(session: aiohttp.ClientSession,
+                                  scan: Callable[[Callable[[DownloadTask], None]],
+                                                 Awaitable[None]]) -> int:
     """
-    Download files concurrently and display a global progress bar.
+    Download files while they are still being found by the scan.
+
+    If the scan fails, the download is cancelled and awaited before the error is raised, so
+    nothing keeps downloading in the background.
 
     Parameters
     ----------
     session : aiohttp.ClientSession
         The active client session for making HTTP requests.
-    files_to_download : list
-        of dictionaries containing the download URL and local path.
+    scan : Callable
+        Coroutine function that passes DownloadTask of every new or changed file to the given
+        callable.
+
+    Returns
+    -------
+    int
+        Number of downloaded and copied files.
+    """
+    queue = asyncio.Queue()
+    download_task = asyncio.create_task(download_queued_files(session, queue))
+    try:
+        await scan(queue.put_nowait)
+    except BaseException:
+        download_task.cancel()
+        await asyncio.gather(download_task, return_exceptions=True)
+        raise
+    queue.put_nowait(None)
+    return await download_task
+
+
+async def download_queued_files(session: aiohttp.ClientSession, queue: asyncio.Queue,
+                                max_concurrent: int | None = None) -> int:
     """
-    total_size = sum(
-        int(file_info['size']) for file_info in files_to_download)  # Общий размер всех файлов
-    download_tasks = []
+    Download files from the queue while they are still being found and display a global
+    progress bar. Its total grows as files are taken from the queue. Stops when None is taken
+    from the queue.
 
-    # Создание общего прогресс-бара
-    with tqdm(total=total_size, unit='B', unit_scale=True, desc="Downloading files",
-              dynamic_ncols=True) as pbar:
-        for file_info in files_to_download:
-            download_tasks.append(
-                fetch_file(session, file_info['download_url'], file_info['local_path'], pbar))
-        await asyncio.gather(*download_tasks)
+    Files with equal SHA are downloaded once, the rest are copied from the downloaded one.
+    Files are downloaded over HTTP/2 if httpx with h2 is installed, otherwise with the session.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
+    queue : asyncio.Queue
+        of DownloadTask.
+    max_concurrent : int, optional
+        Maximum number of files downloaded at the same time, by default from
+        get_max_concurrent_downloads.
+
+    Returns
+    -------
+    int
+        Number of downloaded and copied files.
+    """
+    unique_files = {}
+    duplicates = []
+    local_paths = set()
+    verified_shas = set()
+    max_concurrent = max_concurrent or get_max_concurrent_downloads()
+    client = create_h2_client()
+    if client is None:
+        fetch = functools.partial(fetch_file, session)
+    else:
+        fetch = functools.partial(fetch_file_h2, client)
+
+    async def worker() -> None:
+        while (file_info := await queue.get()) is not None:
+            if file_info.local_path in local_paths:
+                # Два одновременных скачивания в один файл испортили бы его
+                logging.warning("%s is already being downloaded, skipped.", file_info.local_path)
+                continue
+            local_paths.add(file_info.local_path)
+            first_file_info = unique_files.setdefault(file_info.sha, file_info)
+            if first_file_info is not file_info:
+                duplicates.append(file_info)
+                continue
+            # Общий размер растёт по мере сканирования
+            pbar.total += file_info.size
+            pbar.refresh()
+            sha1 = await fetch(file_info.download_url, file_info.local_path, file_info.size, pbar)
+            if sha1 != file_info.sha:
+                # Не запоминаем хэш повреждённого файла, при следующем запуске он скачается снова
+                logging.warning("%s: SHA1 %s does not match %s, not cached.",
+                                file_info.local_path, sha1, file_info.sha)
+                continue
+            verified_shas.add(sha1)
+            _remember_sha1(file_info)
+        # Возвращаем None в очередь, чтобы остановились остальные обработчики
+        queue.put_nowait(None)
 
+    try:
+        with tqdm(total=0, unit='B', unit_scale=True, desc="Downloading files",
+                  dynamic_ncols=True, mininterval=0.25, miniters=1 << 20) as pbar:
+            await _run_workers([asyncio.create_task(worker()) for _ in range(max_concurrent)])
+    finally:
+        if client is not None:
+            await client.aclose()
+    await copy_files([(unique_files[file_info.sha].local_path, file_info.local_path)
+                      for file_info in duplicates])
+    for file_info in duplicates:
+        if file_info.sha in verified_shas:
+            _remember_sha1(file_info)
+    return len(unique_files) + len(duplicates)
+
+
+async def _run_workers(workers: list) -> None:
+    """
+    Wait for all worker tasks. If one of them fails (or waiting is cancelled), the others are
+    cancelled and awaited before the error is raised, so none of them keeps using the HTTP
+    client or stays blocked on the queue.
+
+    Parameters
+    ----------
+    workers : list
+        of asyncio.Task.
+    """
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+
+
+def _remember_sha1(file_info: DownloadTask) -> None:
+    """
+    Store SHA1 of the just written and verified file in the hash manifest, so it is not hashed
+    again on the next scan while its size and mtime are unchanged.
+
+    Parameters
+    ----------
+    file_info : DownloadTask
+        Downloaded or copied file.
+    """
+    store_sha1(file_info.local_path, os.stat(file_info.local_path), file_info.sha)
+
+
+def create_h2_client() -> 'httpx.AsyncClient | None':
+    """
+    Create HTTP/2 client for raw file downloads: many concurrent requests are multiplexed over
+    a few connections instead of a TLS connection per request.
+
+    Returns
+    -------
+    httpx.AsyncClient or None
+        None if httpx or h2 is not installed.
+    """
+    if httpx is None:
+        return None
+    limits = httpx.Limits(max_connections=H2_MAX_CONNECTIONS,
+                          max_keepalive_connections=H2_MAX_CONNECTIONS)
+    # Без ограничения ожидания пула: если сервер ответит по HTTP/1.1, обработчиков больше, чем
+    # соединений, и они ждут своей очереди, а не падают с PoolTimeout
+    timeout = httpx.Timeout(60, connect=15, pool=None)
+    # Перенаправления и User-Agent как у сессии aiohttp из create_session
+    return httpx.AsyncClient(http2=True, limits=limits, timeout=timeout, follow_redirects=True,
+                             headers={'User-Agent': USER_AGENT})
+
+
+async def copy_files(copies: list) -> None:
+    """
+    Copy already downloaded files to other destinations in the default thread pool.
+
+    Copies are used instead of hard links: a later update of one of the paths truncates and
+    rewrites the file in place, which would silently change every linked path too.
+
+    Parameters
+    ----------
+    copies : list
+        of (source path, destination path) tuples.
+    """
+    if not copies:
+        return
+    loop = asyncio.get_running_loop()
+    logging.info("Copying %d duplicate files...", len(copies))
+    await asyncio.gather(*(loop.run_in_executor(None, shutil.copyfile, src_path, dest_path)
+                           for src_path, dest_path in copies))
 
-async def fetch_file(session: aiohttp.ClientSession, url: str, dest_path: str, pbar):
+
+async def fetch_file(session: aiohttp.ClientSession, url: str, dest_path: str, size: int,
+                     pbar) -> str:
     """
     Asynchronously download a file from the given URL.
 
@@ -43,26 +274,188 @@ async def fetch_file(session: aiohttp.ClientSession, url: str, dest_path: str, p
         The URL of the file to download.
     dest_path : str
         The destination path to save the file.
+    size : int
+        Expected file size, used in the git blob header of SHA1.
     pbar : tqdm
         The progress bar to update for overall progress.
+
+    Returns
+    -------
+    str
+        Git blob SHA1 of the downloaded content.
     """
     try:
-        async with session.get(url) as response:
+        async with session.get(url, read_bufsize=READ_BUFFER_SIZE) as response:
             response.raise_for_status()
-            chunk_size = 1024  # Размер куска данных для загрузки
-            async with aiofiles.open(dest_path, 'wb') as file:
-                async for chunk in response.content.iter_chunked(chunk_size):
-                    await file.write(chunk)
-                    pbar.update(len(chunk))  # Обновляем общий прогресс-бар
+            # Берём всё, что уже получено, а не куски фиксированного размера
+            return await _write_stream(response.content.iter_any(), dest_path, size, pbar)
+    except Exception as e:
+        logging.error("Error downloading file from %s to %s: %r", url, dest_path, e)
+        raise
+
+
+async def fetch_file_h2(client: 'httpx.AsyncClient', url: str, dest_path: str, size: int,
+                        pbar) -> str:
+    """
+    Asynchronously download a file from the given URL over HTTP/2.
+
+    Parameters
+    ----------
+    client : httpx.AsyncClient
+        The active HTTP/2 client, requests to the same host share its connections.
+    url : str
+        The URL of the file to download.
+    dest_path : str
+        The destination path to save the file.
+    size : int
+        Expected file size, used in the git blob header of SHA1.
+    pbar : tqdm
+        The progress bar to update for overall progress.
 
+    Returns
+    -------
+    str
+        Git blob SHA1 of the downloaded content.
+    """
+    try:
+        async with client.stream('GET', url) as response:
+            response.raise_for_status()
+            return await _write_stream(response.aiter_bytes(CHUNK_SIZE), dest_path, size, pbar)
     except Exception as e:
-        logging.error(f"Error downloading file from {url} to {dest_path}: {e}")
+        # У исключений httpx (например, PoolTimeout) бывает пустой текст, поэтому repr
+        logging.error("Error downloading file from %s to %s: %r", url, dest_path, e)
         raise
 
 
+async def _write_stream(chunks: AsyncIterator[bytes], dest_path: str, size: int, pbar) -> str:
+    """
+    Write downloaded chunks to the file and calculate git blob SHA1 of them on the way.
+
+    Parameters
+    ----------
+    chunks : AsyncIterator[bytes]
+        Response body.
+    dest_path : str
+        The destination path to save the file.
+    size : int
+        Expected file size, used in the git blob header.
+    pbar : tqdm
+        The progress bar to update for overall progress.
+
+    Returns
+    -------
+    str
+        SHA1 hash in hexadecimal format.
+    """
+    loop = asyncio.get_running_loop()
+    buffer = bytearray()
+    # Хэш считается как в git: заголовок 'blob <size>\0' и содержимое
+    sha1 = hashlib.sha1(b'blob %d\0' % size)
+    # Создание файла тоже может блокировать (антивирус на Windows), открываем в потоке
+    opening = loop.run_in_executor(None, os.open, dest_path,
+                                   os.O_WRONLY | os.O_CREAT | os.O_TRUNC | O_BINARY)
+    try:
+        fd = await asyncio.shield(opening)
+    except asyncio.CancelledError:
+        # Поток всё равно откроет файл, закрываем его, когда это произойдёт
+        opening.add_done_callback(_close_opened)
+        raise
+    writing = None
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            # Пишем на диск большими блоками в отдельном потоке
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                writing = loop.run_in_executor(None, _write_all, fd, buffer, sha1)
+                await asyncio.shield(writing)
+                writing = None
+                pbar.update(len(buffer))  # Обновляем общий прогресс-бар
+                buffer.clear()
+    except BaseException:
+        if writing is None:
+            os.close(fd)
+        else:
+            # При отмене поток ещё может писать в файл, закрываем его после записи
+            writing.add_done_callback(functools.partial(_close_after_write, fd))
+        raise
+    # Остаток буфера дописываем и закрываем файл за один переход в поток
+    await loop.run_in_executor(None, _write_all_and_close, fd, buffer, sha1)
+    pbar.update(len(buffer))
+    return sha1.hexdigest()
+
+
+def _close_opened(opening: asyncio.Future) -> None:
+    """
+    Close the file descriptor opened by os.open call whose result nobody waits for anymore.
+
+    Parameters
+    ----------
+    opening : asyncio.Future
+        Finished os.open call from the thread pool.
+    """
+    if not opening.cancelled() and opening.exception() is None:
+        os.close(opening.result())
+
+
+def _close_after_write(fd: int, writing: asyncio.Future) -> None:
+    """
+    Close the file descriptor after the write whose result nobody waits for anymore.
+
+    Parameters
+    ----------
+    fd : int
+        File descriptor opened for writing.
+    writing : asyncio.Future
+        Finished _write_all call from the thread pool.
+    """
+    if not writing.cancelled():
+        # Ошибка записи уже никому не нужна, но её нужно забрать, чтобы asyncio не ругался
+        writing.exception()
+    os.close(fd)
+
+
+def _write_all(fd: int, data: bytearray, sha1) -> None:
+    """
+    Add the buffer to the hash and write it to the file descriptor.
+
+    Parameters
+    ----------
+    fd : int
+        File descriptor opened for writing.
+    data : bytearray
+        Data to write.
+    sha1 : hashlib.sha1
+        Hash of the data written so far.
+    """
+    sha1.update(data)
+    with memoryview(data) as view:
+        written = 0
+        while written < len(view):
+            written += os.write(fd, view[written:])
+
+
+def _write_all_and_close(fd: int, data: bytearray, sha1) -> None:
+    """
+    Write the rest of the buffer and close the file descriptor.
+
+    Parameters
+    ----------
+    fd : int
+        File descriptor opened for writing.
+    data : bytearray
+        Data to write, may be empty.
+    sha1 : hashlib.sha1
+        Hash of the data written so far.
+    """
+    try:
+        _write_all(fd, data, sha1)
+    finally:
+        os.close(fd)
+
+
 async def delete_files(files: list) -> None:
     """
-    Delete files concurrently and display a global progress bar.
+    Delete files concurrently in the default thread pool and display a global progress bar.
 
     Parameters
     ----------
@@ -70,13 +463,17 @@ async def delete_files(files: list) -> None:
         of dictionaries containing the local path and size.
     """
     total_size = sum(int(file_info['size']) for file_info in files)  # Общий размер всех файлов
+    loop = asyncio.get_running_loop()
+
+    async def delete_file(file_info: dict) -> int:
+        try:
+            await loop.run_in_executor(None, os.unlink, file_info['local_path'])
+        except FileNotFoundError as e:
+            msg = f"File {file_info['local_path']} missing: {e}"
+            logging.error(msg)
+        return int(file_info['size'])
 
     with tqdm(total=total_size, unit='B', unit_scale=True, desc="Deleting files",
               dynamic_ncols=True) as pbar:
-        for file_info in files:
-            try:
-                Path(file_info['local_path']).unlink(missing_ok=True)
-                pbar.update()
-            except FileNotFoundError as e:
-                msg = f"File {file_info['local_path']} missing: {e}"
-                logging.error(msg)
+        for deleted in asyncio.as_completed([delete_file(file_info) for file_info in files]):
+            pbar.update(await deleted)
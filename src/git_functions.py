@@ -1,20 +1,51 @@
 # pylint: disable=logging-fstring-interpolation
 
+import asyncio
+import hashlib
 import logging
+import mmap
 import os
+import random
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Callable, Iterator
+from urllib.parse import quote
 
 import aiohttp
 import psutil
-import pygit2
 from tqdm import tqdm
 
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    # json.loads тоже принимает bytes
+    from json import loads as _json_loads
+
+from src.etag_cache import load_etag, store_etag
+from src.files import DownloadTask, get_max_concurrent_downloads
+from src.hash_cache import get_cached_sha1, store_sha1
+from src.local_version import USER_AGENT
+
+# Мелкие файлы отправляются на хэширование пачками, чтобы не платить за IPC на каждый файл
+HASH_BATCH_FILES = 64
+HASH_BATCH_BYTES = 16 * 1024 * 1024
+# Временные ошибки сервера, после которых запрос повторяется
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+GITHUB_API_VERSION = '2022-11-28'
+# Вторичный лимит без заголовков: GitHub просит подождать не меньше минуты
+SECONDARY_RATE_LIMIT_WAIT = 60.
+# Без ограничения общего времени: крупный файл на медленном канале качается дольше 5 минут
+SESSION_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=60)
+
+_hash_executor: ProcessPoolExecutor | None = None  # pylint: disable=invalid-name
+# Время (UTC epoch) сброса лимита запросов, если он исчерпан
+_rate_limit_reset = 0.  # pylint: disable=invalid-name
+
 
 def calculate_sha1(file_path):
     """
-    Calculate the SHA1 hash of a file using pygit2.
+    Calculate the git blob SHA1 hash of a file (same as `git hash-object`).
 
     Parameters
     ----------
@@ -26,27 +57,91 @@ def calculate_sha1(file_path):
     str
         The SHA1 hash of the file in hexadecimal format.
     """
-    # Ensure the file exists before trying to read
-    if not os.path.isfile(file_path):
-        return None
-
     try:
-        # Use pygit2 to compute the SHA1
         with open(file_path, 'rb') as f:
-            # Read the file content
-            data = f.read()
-            # Compute SHA1 hash
-            sha1 = pygit2.hash(data)
+            size = os.fstat(f.fileno()).st_size
+            # Git blob hash is SHA1 of header 'blob <size>\0' followed by the content
+            sha1 = hashlib.sha1(b'blob %d\0' % size)
+            if size:
+                # File is mapped to memory instead of copying it into Python bytes,
+                # hashlib releases GIL while hashing the buffer
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    sha1.update(mm)
+    except (FileNotFoundError, IsADirectoryError):
+        return None
     except Exception as e:
         logging.error(f"Error reading file {file_path}: {e}")
         return None  # Return None if there was an error
 
-    return str(sha1)
+    return sha1.hexdigest()
+
+
+def calculate_sha1_batch(file_paths: list) -> list:
+    """
+    Calculate the git blob SHA1 hashes of several files in one call of a worker process.
+
+    Parameters
+    ----------
+    file_paths : list
+        of paths to the files.
+
+    Returns
+    -------
+    list
+        SHA1 hashes in hexadecimal format (None for unreadable files) in the same order.
+    """
+    return [calculate_sha1(file_path) for file_path in file_paths]
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Create client session with connection pool reused for all requests to GitHub.
+
+    If GITHUB_TOKEN environment variable is set, requests are authenticated with it and use
+    the personal rate limit of the user (5000 requests/hour instead of 60).
+
+    Returns
+    -------
+    aiohttp.ClientSession
+    """
+    # Соединений к одному хосту столько же, сколько одновременных загрузок
+    max_concurrent = get_max_concurrent_downloads()
+    connector = aiohttp.TCPConnector(limit=2 * max_concurrent, limit_per_host=max_concurrent,
+                                     ttl_dns_cache=300, keepalive_timeout=60,
+                                     enable_cleanup_closed=True)
+    # Accept-Encoding: gzip, deflate aiohttp добавляет сам и распаковывает ответ прозрачно
+    headers = {'User-Agent': USER_AGENT, 'Accept': 'application/vnd.github+json',
+               'X-GitHub-Api-Version': GITHUB_API_VERSION}
+    token = os.environ.get('GITHUB_TOKEN')
+    if token:
+        headers['Authorization'] = f'token {token}'
+    else:
+        logging.warning("GITHUB_TOKEN is not set, GitHub API rate limit is 60 requests/hour.")
+    return aiohttp.ClientSession(connector=connector, headers=headers, timeout=SESSION_TIMEOUT)
+
+
+def get_hash_executor() -> ProcessPoolExecutor:
+    """
+    Get process pool to calculate SHA1 of local files on all physical cores.
+
+    The pool is created on first use and reused for the whole run, so worker processes are
+    not spawned again for every install or uninstall.
+
+    Returns
+    -------
+    ProcessPoolExecutor
+    """
+    global _hash_executor  # pylint: disable=global-statement
+    if _hash_executor is None:
+        _hash_executor = ProcessPoolExecutor(max_workers=psutil.cpu_count(logical=False))
+    return _hash_executor
 
 
 async def fetch_tree_contents(url: str, session: aiohttp.ClientSession,
-                              folder: str, local_path: str, files: list,
-                              is_delete: bool = False, raw_base_url: str = '') -> None:
+                              folder: str, local_path: str,
+                              add_file: Callable[[DownloadTask | dict], None], *,
+                              is_delete: bool = False, raw_base_url: str = '',
+                              tree: dict | None = None) -> None:
     """
     Fetch contents of the specified tree SHA with parallel SHA1 calculations.
 
@@ -61,52 +156,237 @@ async def fetch_tree_contents(url: str, session: aiohttp.ClientSession,
         Folder name.
     local_path : str
         The local path where the folder contents should be saved.
-    files : list
-        The list to store the details of files that need to be downloaded.
+    add_file : Callable
+        Called with the details of every file that needs to be downloaded (or deleted), like
+        list.append, or Queue.put_nowait to start downloading before the scan is finished.
     is_delete : bool
         True for uninstall, False for install
     raw_base_url : str
         strongly required for is_delete = False
         of main or master branch like
          'https://raw.githubusercontent.com/DarkMatro/Texture-and-Sounds-mods-by-Max/master'
+    tree : dict, optional
+        Tree of the folder taken from the repository tree by split_tree, used without
+        a request. If None, the tree of the folder is requested.
     """
-    url = f'{url}:{folder}?recursive=1'
-    tree_contents = await fetch_with_retry(session, url)
-    if not tree_contents:
+    if tree is None:
+        tree = await fetch_with_retry(session, f'{url}:{folder}?recursive=1')
+    if not tree:
         return
 
-    total_files = len([item for item in tree_contents['tree'] if item['type'] == 'blob'])
-
-    # Используем прогресс-бар с общим количеством файлов
-    with tqdm(total=total_files, desc=f"Scanning {folder}", unit=' files',
-              dynamic_ncols=True) as pbar:
-        with ThreadPoolExecutor(max_workers=psutil.cpu_count(logical=False)) as executor:
-            futures = []
-
-            for item in tree_contents['tree']:
-                if item['type'] == 'tree':
-                    sub_folder_local_path = os.path.join(local_path, item['path'])
-                    if not os.path.exists(sub_folder_local_path):
-                        os.makedirs(sub_folder_local_path)
-                elif item['type'] == 'blob':
-                    # Добавляем задачу в пул потоков
-                    if is_delete:
-                        future = executor.submit(check_and_prepare_file_to_delete, item, local_path,
-                                                 files)
-                    else:
-                        future = executor.submit(check_and_prepare_file, item, folder, local_path,
-                                                 files, raw_base_url)
-                    futures.append(future)
-
-            # Обновляем прогресс-бар по завершению каждой задачи
-            for future in as_completed(futures):
-                future.result()  # Получаем результат (если есть исключение - поднимаем его)
-                pbar.update()  # Обновляем прогресс-бар
+    with tqdm(total=0, desc=f"Scanning {folder}", unit=' files', dynamic_ncols=True) as pbar:
+
+        def check_item(item: dict, local_file_path: str, local_sha1: str | None) -> None:
+            if is_delete:
+                file_info = check_and_prepare_file_to_delete(item, local_file_path, local_sha1)
+            else:
+                file_info = check_and_prepare_file(item, folder, local_file_path, local_sha1,
+                                                   raw_base_url)
+            if file_info is not None:
+                add_file(file_info)
+            pbar.update()  # Обновляем прогресс-бар
+
+        async def check_batch(batch: list) -> None:
+            sha1s = await asyncio.get_running_loop().run_in_executor(
+                get_hash_executor(), calculate_sha1_batch,
+                [local_file_path for _, local_file_path, _ in batch])
+            for (item, local_file_path, stat), local_sha1 in zip(batch, sha1s):
+                store_sha1(local_file_path, stat, local_sha1)
+                check_item(item, local_file_path, local_sha1)
+
+        # Подпапки создаются до начала загрузок, удаление их не трогает
+        checked, to_hash = _scan_local_tree(tree['tree'], local_path, make_dirs=not is_delete)
+        pbar.total = len(checked) + len(to_hash)
+        pbar.refresh()
+        for entry in checked:
+            check_item(*entry)
+        # Крупные файлы хэшируются первыми, чтобы в конце не ждать один большой файл
+        to_hash.sort(key=lambda entry: entry[2].st_size, reverse=True)
+        await asyncio.gather(*(check_batch(batch) for batch in _batch_by_size(to_hash)))
+
+
+async def fetch_full_tree(session: aiohttp.ClientSession, url: str) -> dict | None:
+    """
+    Fetch recursive tree of the whole repository with one request instead of one per folder.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
+    url : str
+        of main or master branch like
+         'https://api.github.com/repos/ehylla93/had2-cmp/git/trees/main'
+
+    Returns
+    -------
+    dict or None
+        None if the tree is not available or truncated by GitHub (more than 100 000 entries),
+        then folders have to be requested one by one.
+    """
+    tree = await fetch_with_retry(session, f'{url}?recursive=1')
+    if not tree or tree.get('truncated'):
+        return None
+    return tree
+
+
+def split_tree(tree: dict | None, folders: list) -> dict:
+    """
+    Split the recursive tree of the repository into trees of the folders in one pass.
+
+    Parameters
+    ----------
+    tree : dict or None
+        Recursive tree of the repository from fetch_full_tree.
+    folders : list
+        Names of the top-level folders.
+
+    Returns
+    -------
+    dict
+        folder -> tree with the items of the folder only, paths are relative to the folder like
+        in the response for '<ref>:<folder>?recursive=1'. Trees are None if the tree of
+        the repository is None, then folders have to be requested one by one.
+    """
+    if tree is None:
+        return dict.fromkeys(folders)
+    sub_trees = {folder: {'tree': []} for folder in folders}
+    for item in tree['tree']:
+        # Раскладываем элементы по папке верхнего уровня
+        folder, sep, path = item['path'].partition('/')
+        if sep and folder in sub_trees:
+            sub_trees[folder]['tree'].append({**item, 'path': path})
+    return sub_trees
+
+
+def _scan_local_tree(items: list, local_path: str, make_dirs: bool) -> tuple[list, list]:
+    """
+    Match items of the GitHub tree with local files.
+
+    Parameters
+    ----------
+    items : list
+        'tree' list of the GitHub tree response.
+    local_path : str
+        The local path of the scanned folder.
+    make_dirs : bool
+        Create local folders for all subfolders of the tree.
+
+    Returns
+    -------
+    tuple: (checked, to_hash)
+        checked - (item, local file path, SHA1 or None) of files whose SHA1 is known from
+        the manifest or not needed because the file is missing or has other size.
+        to_hash - (item, local file path, stat) of files whose SHA1 must be calculated.
+    """
+    # Содержимое папок читается один раз и только для папок из дерева
+    local_dirs = {}
+    sub_folders = []
+    checked = []
+    to_hash = []
+    for item in items:
+        if item['type'] == 'tree':
+            sub_folders.append(os.path.join(local_path, item['path']))
+            continue
+        if item['type'] != 'blob':
+            continue
+        local_file_path = os.path.join(local_path, item['path'])
+        stat = _get_local_stat(local_dirs, local_path, item['path'])
+        if stat is None or stat.st_size != item['size']:
+            # Отсутствующий файл или файл другого размера не нужно хэшировать
+            checked.append((item, local_file_path, None))
+            continue
+        local_sha1 = get_cached_sha1(local_file_path, stat)
+        if local_sha1 is None:
+            to_hash.append((item, local_file_path, stat))
+        else:
+            checked.append((item, local_file_path, local_sha1))
+    if make_dirs:
+        # Родительские папки идут раньше вложенных
+        for sub_folder_local_path in sorted(sub_folders):
+            Path(sub_folder_local_path).mkdir(parents=True, exist_ok=True)
+    return checked, to_hash
+
+
+def _get_local_stat(local_dirs: dict, root: str, path: str) -> os.stat_result | None:
+    """
+    Get stat of the local file from the listing of its folder.
+
+    Each folder is listed with os.scandir once and only if the tree has files in it, so
+    unrelated game folders are not walked. On Windows the size and mtime come with the listing,
+    no separate stat() call is made per file.
+
+    Parameters
+    ----------
+    local_dirs : dict
+        Cache of folder listings: relative folder path -> {normcase(name): os.DirEntry}.
+    root : str
+        The local path of the scanned folder.
+    path : str
+        Path of the file relative to the root with '/' separators like in the GitHub tree.
+
+    Returns
+    -------
+    os.stat_result or None
+        None if the file is missing.
+    """
+    parent, _, name = path.rpartition('/')
+    entries = local_dirs.get(parent)
+    if entries is None:
+        entries = {}
+        try:
+            with os.scandir(os.path.join(root, parent)) as it:
+                # normcase: на Windows имена файлов не зависят от регистра, как и у os.stat
+                entries = {os.path.normcase(entry.name): entry for entry in it}
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        local_dirs[parent] = entries
+    entry = entries.get(os.path.normcase(name))
+    if entry is None:
+        return None
+    try:
+        if not entry.is_file():
+            return None
+        return entry.stat()
+    except FileNotFoundError:
+        return None
+
+
+def _batch_by_size(entries: list) -> Iterator[list]:
+    """
+    Split files to hash into batches of at most HASH_BATCH_FILES files or HASH_BATCH_BYTES bytes.
+    A file larger than HASH_BATCH_BYTES makes a batch of its own.
+
+    Parameters
+    ----------
+    entries : list
+        of (item, local_file_path, stat) tuples.
+
+    Yields
+    ------
+    list
+        of (item, local_file_path, stat) tuples.
+    """
+    batch = []
+    batch_bytes = 0
+    for entry in entries:
+        size = entry[2].st_size
+        if batch and (len(batch) == HASH_BATCH_FILES or batch_bytes + size > HASH_BATCH_BYTES):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(entry)
+        batch_bytes += size
+    if batch:
+        yield batch
 
 
 async def fetch_with_retry(session, url, retries=3, backoff_factor=2) -> dict | list:
     """
-    Fetch data from GitHub with retry logic on rate limit errors.
+    Fetch data from GitHub with retry logic on rate limit, server and connection errors.
+
+    Request is conditional (If-None-Match) if the URL was fetched before, on 304 Not Modified
+    the cached content is returned. If the previous response used the last request of the rate
+    limit, the request waits for the limit reset instead of being rejected.
 
     Parameters
     ----------
@@ -124,32 +404,108 @@ async def fetch_with_retry(session, url, retries=3, backoff_factor=2) -> dict |
     list or dict
         The JSON content of the response.
     """
-    for _ in range(retries):
-        async with session.get(url) as response:
-            if response.status == 403 and 'rate limit' in await response.text():
-                retry_after = int(response.headers.get('Retry-After', backoff_factor))
-                print(f"Requests Rate limit exceeded. Retrying in {retry_after} seconds...")
-                time.sleep(retry_after)
-            elif response.status == 404:
-                logging.error(f"Error 404: Not Found. URL: {url}")
-                return []
-            elif response.status == 401:
-                print("Error 401: Unauthorized")
-                logging.error("Error 401: Unauthorized")
-                return []
-            else:
-                response.raise_for_status()
-                return await response.json()
+    global _rate_limit_reset  # pylint: disable=global-statement
+    etag, cached_data = load_etag(url)
+    headers = {'If-None-Match': etag} if etag else None
+    for attempt in range(1, retries + 1):
+        wait = _rate_limit_reset - time.time()
+        if wait > 0:
+            print(f"Requests Rate limit reached. Waiting {wait:.1f} seconds for reset...")
+            await asyncio.sleep(wait)
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.headers.get('X-RateLimit-Remaining') == '0':
+                    _rate_limit_reset = time.time() + get_retry_after(response.headers, 0.)
+                if response.status == 304:
+                    return cached_data
+                if is_rate_limited(response):
+                    reason = "Requests Rate limit exceeded."
+                    retry_after = get_retry_after(
+                        response.headers,
+                        SECONDARY_RATE_LIMIT_WAIT if response.status == 403
+                        else backoff_factor ** attempt)
+                elif response.status in RETRY_STATUSES:
+                    reason = f"GitHub API error {response.status}."
+                    retry_after = backoff_factor ** attempt
+                elif response.status == 404:
+                    logging.error(f"Error 404: Not Found. URL: {url}")
+                    return []
+                elif response.status == 401:
+                    print("Error 401: Unauthorized")
+                    logging.error("Error 401: Unauthorized")
+                    return []
+                else:
+                    response.raise_for_status()
+                    # orjson, если установлен, разбирает большие деревья заметно быстрее json
+                    data = _json_loads(await response.read())
+                    if 'ETag' in response.headers:
+                        store_etag(url, response.headers['ETag'], data)
+                    return data
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            reason = f"Connection error: {e!r}."
+            retry_after = backoff_factor ** attempt
+        logging.warning(f"{reason} URL: {url}")
+        if attempt == retries:
+            break
+        # Ждём вне контекста ответа, чтобы соединение вернулось в пул
+        retry_after += random.random()
+        print(f"{reason} Retrying in {retry_after:.1f} seconds...")
+        await asyncio.sleep(retry_after)
     msg = f"Failed to fetch data after {retries} attempts. Try again later."
     logging.error(msg)
     print(msg)
     raise ConnectionError(msg)
 
 
-def check_and_prepare_file(item, folder, local_path, files_to_download, raw_base_url):
+def is_rate_limited(response: aiohttp.ClientResponse) -> bool:
+    """
+    Check if GitHub rejected the request because of the rate limit.
+
+    Only the status is checked, the body is not read. GitHub may send a secondary rate limit
+    403 without 'Retry-After' and 'X-RateLimit-Remaining', so every 403 is treated as the rate
+    limit and retried.
+
+    Parameters
+    ----------
+    response : aiohttp.ClientResponse
+
+    Returns
+    -------
+    bool
+        True for 403 and 429.
+    """
+    return response.status in (403, 429)
+
+
+def get_retry_after(headers, default: float) -> float:
+    """
+    Get number of seconds to wait before retry from GitHub rate limit response headers.
+
+    Parameters
+    ----------
+    headers : Mapping
+        Response headers.
+    default : float
+        used if neither 'Retry-After' nor 'X-RateLimit-Reset' is present.
+
+    Returns
+    -------
+    float
+        Seconds to wait.
+    """
+    if 'Retry-After' in headers:
+        return float(headers['Retry-After'])
+    if 'X-RateLimit-Reset' in headers:
+        # Время сброса лимита передаётся в секундах UTC epoch
+        return max(float(headers['X-RateLimit-Reset']) - time.time(), 0.)
+    return default
+
+
+def check_and_prepare_file(item, folder, local_file_path, local_sha1,
+                           raw_base_url) -> DownloadTask | None:
     """
-    Check if the file exists and its SHA1 matches the expected value. If not, add it to the download
-    list.
+    Check if the file exists and its SHA1 matches the expected value. If not, return it to
+    download.
 
     Parameters
     ----------
@@ -157,41 +513,51 @@ def check_and_prepare_file(item, folder, local_path, files_to_download, raw_base
         File metadata from the GitHub API tree.
     folder : str
         The folder being scanned.
-    local_path : str
-        The local path where files are stored.
-    files_to_download : list
-        of files to download if they are missing or have mismatched hashes.
+    local_file_path : str
+        The local path of the file.
+    local_sha1 : str or None
+        SHA1 of the local file, None if it is missing or its size differs.
     raw_base_url : str
         of main or master branch like
          'https://raw.githubusercontent.com/DarkMatro/Texture-and-Sounds-mods-by-Max/master'
+
+    Returns
+    -------
+    DownloadTask or None
+        None if the local file is up-to-date.
     """
-    local_file_path = os.path.join(local_path, item['path'])
     # Проверяем, если файл не существует или его SHA1 хэш не совпадает с указанным
-    if not Path(local_file_path).exists() or item['sha'] != calculate_sha1(local_file_path):
-        # Если файл не совпадает, добавляем его в список для скачивания
-        files_to_download.append({
-            'download_url': f"{raw_base_url}/{folder}/{item['path'].replace('#', '%23')}",
-            'local_path': local_file_path,
-            'size': item['size']
-        })
+    target_sha = item['sha']
+    # Оба хэша - hex строки в нижнем регистре, None ни с чем не совпадает
+    if local_sha1 == target_sha:
+        return None
+    # Если файл не совпадает, возвращаем его для скачивания. Путь экранируется заранее ('#',
+    # '%', пробелы), чтобы aiohttp и httpx запросили один и тот же URL
+    path = quote(f"{folder}/{item['path']}")
+    return DownloadTask(f"{raw_base_url}/{path}", local_file_path, item['size'], target_sha)
 
 
-def check_and_prepare_file_to_delete(item, local_path, files_to_delete):
+def check_and_prepare_file_to_delete(item, local_file_path, local_sha1) -> dict | None:
     """
-    Check if the file exists and its SHA1 matches the expected value. If yes, add it to the delete
-    list.
+    Check if the file exists and its SHA1 matches the expected value. If yes, return it to
+    delete.
 
     Parameters
     ----------
     item : dict
         File metadata from the GitHub API tree.
-    local_path : str
-        The local path where files are stored.
-    files_to_delete : list
-        of files to download if they are missing or have mismatched hashes.
+    local_file_path : str
+        The local path of the file.
+    local_sha1 : str or None
+        SHA1 of the local file, None if it is missing.
+
+    Returns
+    -------
+    dict or None
+        The local path and size of the file, None if it is missing or was changed.
     """
-    local_file_path = os.path.join(local_path, item['path'])
     # Проверяем, если файл не существует или его SHA1 хэш не совпадает с указанным
-    if Path(local_file_path).exists() and item['sha'] == calculate_sha1(local_file_path):
-        # Если файл совпадает, добавляем его в список для удаления
-        files_to_delete.append({'local_path': local_file_path, 'size': item['size']})
+    if local_sha1 != item['sha']:
+        return None
+    # Если файл совпадает, возвращаем его для удаления
+    return {'local_path': local_file_path, 'size': item['size']}
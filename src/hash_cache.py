@@ -0,0 +1,55 @@
+import os
+
+from src.json_cache import JsonCache
+
+MANIFEST_FILE = 'hd2_sync_manifest.json'
+
+# absolute file path -> [size, mtime_ns, sha1]
+_manifest = JsonCache(MANIFEST_FILE, 'hash manifest')
+
+
+def get_cached_sha1(file_path: str, stat: os.stat_result) -> str | None:
+    """
+    Return SHA1 of the file from the manifest if its size and mtime are unchanged.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the file.
+    stat : os.stat_result
+        Current stat of the file.
+
+    Returns
+    -------
+    str or None
+        None if the manifest entry is missing or stale.
+    """
+    entry = _manifest.get(os.path.abspath(file_path))
+    if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+        return entry[2]
+    return None
+
+
+def store_sha1(file_path: str, stat: os.stat_result, sha1: str | None) -> None:
+    """
+    Remember SHA1 of the file calculated for the given stat result.
+
+    Parameters
+    ----------
+    file_path : str
+        The path to the file.
+    stat : os.stat_result
+        taken before SHA1 was calculated.
+    sha1 : str or None
+        The SHA1 hash of the file in hexadecimal format. None is not stored.
+    """
+    if sha1 is None:
+        return
+    _manifest.set(os.path.abspath(file_path), [stat.st_size, stat.st_mtime_ns, sha1])
+
+
+def save_manifest() -> None:
+    """
+    Write the manifest to disk.
+    """
+    _manifest.save()
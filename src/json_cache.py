@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+
+class JsonCache:
+    """
+    Dictionary stored in a JSON file: loaded from disk on first use and written back atomically.
+
+    Not thread-safe: the cache is only used from the event loop.
+
+    Parameters
+    ----------
+    path : str
+        JSON file of the cache.
+    name : str
+        Cache name for log messages like 'hash manifest'.
+    """
+
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.name = name
+        self._data: dict | None = None
+
+    def _load(self) -> dict:
+        """
+        Load the cache from disk once.
+
+        Returns
+        -------
+        dict
+            Content of the cache, empty if the file is missing or broken.
+        """
+        if self._data is not None:
+            return self._data
+        self._data = {}
+        if Path(self.path).exists():
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.error("Error reading %s %s: %s", self.name, self.path, e)
+        return self._data
+
+    def get(self, key: str):
+        """
+        Return the cached value or None.
+
+        Parameters
+        ----------
+        key : str
+            Cache key.
+        """
+        return self._load().get(key)
+
+    def set(self, key: str, value) -> None:
+        """
+        Store the value, it is written to disk by save.
+
+        Parameters
+        ----------
+        key : str
+            Cache key.
+        value
+            JSON serializable value.
+        """
+        self._load()[key] = value
+
+    def save(self) -> None:
+        """
+        Write the cache to disk through a temporary file, if it was loaded.
+        """
+        if self._data is None:
+            return
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding="utf-8") as f:
+                json.dump(self._data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error("Error writing %s %s: %s", self.name, self.path, e)
@@ -6,6 +6,8 @@ import logging
 import os
 import re
 import sys
+import threading
+import time
 from pathlib import Path
 import aiohttp
 from tqdm import tqdm
@@ -13,10 +15,17 @@ from aiohttp import ClientTimeout
 
 LOCAL_VERSION_FILE = 'local_version.json'
 LATEST_VERSION = 'v0.0.3'
+USER_AGENT = f'HD2_mod_installer/{LATEST_VERSION}'
 REPO_API_URL = "https://api.github.com/repos/DarkMatro/HD2_mod_installer"
 RAW_BASE_URL_CMP = 'https://raw.githubusercontent.com/ehylla93/had2-cmp/main'
 REPO_API_URL_MAX = "https://api.github.com/repos/DarkMatro/Texture-and-Sounds-mods-by-Max"
 VERSION_FILE_URL_CMP = f'{RAW_BASE_URL_CMP}/README.md'
+CMP_VERSION_TTL = 60
+
+_VERSION_RE = re.compile(r'v(\d+(?:\.\d+)+)', re.ASCII)
+_cmp_version_cache = {'version': None, 'time': 0.}
+_versions: dict | None = None  # pylint: disable=invalid-name
+_lock = threading.Lock()
 
 
 def get_local_version(v_type: str = 'CMP') -> str:
@@ -33,10 +42,8 @@ def get_local_version(v_type: str = 'CMP') -> str:
     str or None
         The local version string if the file exists, otherwise None.
     """
-    _check_version_file()
-    with open(LOCAL_VERSION_FILE, encoding="utf-8") as f:
-        settings = json.load(f)
-    return settings[v_type] if v_type in settings else None
+    with _lock:
+        return _load_versions().get(v_type)
 
 
 def save_local_version(version: str | None, v_type: str = 'CMP'):
@@ -51,22 +58,46 @@ def save_local_version(version: str | None, v_type: str = 'CMP'):
     v_type: str
         'self' or 'CMP'
     """
-    with open(LOCAL_VERSION_FILE, 'r+', encoding="utf-8") as f:
-        data = json.load(f)
-        data[v_type] = version
-        f.seek(0)
-        json.dump(data, f)
-        f.truncate()
+    with _lock:
+        versions = _load_versions()
+        versions[v_type] = version
+        _write_versions(versions)
 
 
-def _check_version_file() -> None:
+def _load_versions() -> dict:
     """
-    Check that version file exists. If it is not - create new.
+    Load versions from the file once per run. If it is missing - create new.
+
+    Returns
+    -------
+    dict
+        Type of mod ('self', 'CMP' or 'Mods by Max') -> version
     """
+    global _versions  # pylint: disable=global-statement
+    if _versions is not None:
+        return _versions
     if Path(LOCAL_VERSION_FILE).exists():
-        return
-    with open(LOCAL_VERSION_FILE, 'w', encoding="utf-8") as f:
-        json.dump(_standard_version(), f)
+        with open(LOCAL_VERSION_FILE, encoding="utf-8") as f:
+            _versions = json.load(f)
+    else:
+        _versions = _standard_version()
+        _write_versions(_versions)
+    return _versions
+
+
+def _write_versions(versions: dict) -> None:
+    """
+    Write versions to the file atomically.
+
+    Parameters
+    ----------
+    versions : dict
+        Type of mod -> version
+    """
+    tmp_path = f'{LOCAL_VERSION_FILE}.tmp'
+    with open(tmp_path, 'w', encoding="utf-8") as f:
+        json.dump(versions, f)
+    os.replace(tmp_path, LOCAL_VERSION_FILE)
 
 
 def _standard_version() -> dict:
@@ -76,56 +107,69 @@ def _standard_version() -> dict:
     return {'self': LATEST_VERSION, 'CMP': None, 'Mods by Max': None}
 
 
-async def check_latest_version():
+async def check_latest_version(session: aiohttp.ClientSession):
     """
     Check actual version and if it's not equal - update.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
     """
-    latest_version, download_url = await fetch_self_actual_version()
+    latest_version, download_url = await fetch_self_actual_version(session)
     if latest_version is None or download_url is None:
         return
     local_version = get_local_version('self')
     if local_version is None or local_version != latest_version:
-        await self_update(latest_version, download_url)
+        await self_update(session, latest_version, download_url)
     else:
         print(f"Program version is actual {latest_version}...")
         logging.info(f"Program version is actual {latest_version}...")
 
 
-async def fetch_self_actual_version() -> tuple:
+async def fetch_self_actual_version(session: aiohttp.ClientSession) -> tuple:
     """
     Fetch the latest version tag and download URL for mod_installer.exe from GitHub.
 
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
+
     Returns:
     --------
     tuple: (latest_version, download_url)
     """
-    async with aiohttp.ClientSession() as session:
-        url = f"{REPO_API_URL}/releases/latest"
-        async with session.get(url) as response:
-            if response.status == 200:
-                release_data = await response.json()
-                latest_version = release_data['tag_name']
-                assets = release_data.get('assets', [])
-
-                download_url = None
-                for asset in assets:
-                    if asset['name'] == 'mod_installer.exe':
-                        download_url = asset['browser_download_url']
-                        break
-                if not download_url:
-                    logging.error("mod_installer.exe not found in the latest release assets.")
-                    return None, None
-                return latest_version, download_url
-            logging.error(f"Failed to fetch the latest version. Status code: {response.status}")
-            return None, None
-
-
-async def self_update(latest_version: str, download_url: str) -> None:
+    url = f"{REPO_API_URL}/releases/latest"
+    async with session.get(url) as response:
+        if response.status == 200:
+            release_data = await response.json()
+            latest_version = release_data['tag_name']
+            assets = release_data.get('assets', [])
+
+            download_url = None
+            for asset in assets:
+                if asset['name'] == 'mod_installer.exe':
+                    download_url = asset['browser_download_url']
+                    break
+            if not download_url:
+                logging.error("mod_installer.exe not found in the latest release assets.")
+                return None, None
+            return latest_version, download_url
+        logging.error(f"Failed to fetch the latest version. Status code: {response.status}")
+        return None, None
+
+
+async def self_update(session: aiohttp.ClientSession, latest_version: str,
+                      download_url: str) -> None:
     """
     Download latest version from program repository and install instead current
 
     Parameters
     -------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
+
     latest_version: str
         like v0.0.1
 
@@ -138,16 +182,12 @@ async def self_update(latest_version: str, download_url: str) -> None:
     temp_exe_path = os.path.join(os.getcwd(), "mod_installer_new.exe")
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(download_url) as response:
-                response.raise_for_status()
-                total_size = int(response.headers.get('content-length', 0))
-                with tqdm(total=total_size, unit='B', unit_scale=True, desc=temp_exe_path,
-                          dynamic_ncols=True) as pbar:
-                    with open(temp_exe_path, 'wb') as f:
-                        async for chunk in response.content.iter_chunked(1024):
-                            f.write(chunk)
-                            pbar.update(len(chunk))
+        async with session.get(download_url) as response:
+            response.raise_for_status()
+            total_size = int(response.headers.get('content-length', 0))
+            with tqdm(total=total_size, unit='B', unit_scale=True, desc=temp_exe_path,
+                      dynamic_ncols=True, mininterval=0.25, miniters=1 << 20) as pbar:
+                await _save_response(response, temp_exe_path, pbar)
 
         save_local_version(latest_version, 'self')
 
@@ -179,69 +219,111 @@ async def self_update(latest_version: str, download_url: str) -> None:
         logging.error(f"Error during self-update: {e}")
 
 
-async def fetch_cmp_version() -> str | None:
+async def _save_response(response: aiohttp.ClientResponse, path: str, pbar) -> None:
+    """
+    Write the response body to the file.
+
+    Parameters
+    ----------
+    response : aiohttp.ClientResponse
+        Response with the file.
+    path : str
+        The destination path to save the file.
+    pbar : tqdm
+        The progress bar to update.
+    """
+    with open(path, 'wb') as f:
+        downloaded = 0
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            f.write(chunk)
+            downloaded += len(chunk)
+            # Прогресс-бар обновляется раз в 1 МиБ, а не на каждый кусок
+            if downloaded >= 1 << 20:
+                pbar.update(downloaded)
+                downloaded = 0
+        pbar.update(downloaded)
+
+
+async def fetch_cmp_version(session: aiohttp.ClientSession) -> str | None:
     """
     Asynchronously fetch the CMP version from the GitHub repository.
 
+    Fetched version is reused for CMP_VERSION_TTL seconds.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
+
     Returns
     -------
     str
         The version string from the repository.
     """
+    if (_cmp_version_cache['version'] is not None
+            and time.monotonic() - _cmp_version_cache['time'] < CMP_VERSION_TTL):
+        return _cmp_version_cache['version']
     try:
-        async with aiohttp.ClientSession(timeout=ClientTimeout(10)) as session:
-            async with session.get(VERSION_FILE_URL_CMP) as response:
-                logging.info(response)
-                response.raise_for_status()
-                text = await response.text()
-                version_match = re.search(r'v([\d\.]+)', text)
-                if version_match:
-                    return version_match.group(1)
-                logging.error("Version information not found in the latest commit message.")
-                return None
+        async with session.get(VERSION_FILE_URL_CMP, timeout=ClientTimeout(10)) as response:
+            logging.info(response)
+            response.raise_for_status()
+            text = await response.text()
+            version_match = _VERSION_RE.search(text)
+            if version_match:
+                _cmp_version_cache['version'] = version_match.group(1)
+                _cmp_version_cache['time'] = time.monotonic()
+                return version_match.group(1)
+            logging.error("Version information not found in the latest commit message.")
+            return None
     except Exception as e:
         logging.error(f"Error fetching version: {e}")
         raise
 
 
-async def fetch_max_version() -> str | None:
+async def fetch_max_version(session: aiohttp.ClientSession) -> str | None:
     """
     Asynchronously fetch the version from the GitHub repository.
 
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
 
     Returns
     -------
     str
         The version string from the repository.
     """
-    async with aiohttp.ClientSession() as session:
-        url = f"{REPO_API_URL_MAX}/releases/latest"
-        async with session.get(url) as response:
-            if response.status == 200:
-                release_data = await response.json()
-                latest_version = release_data['tag_name']
-                return latest_version
-            if response.status == 403:
-                logging.error(f"Failed to fetch the latest max mod version. "
-                              f"Status code: {response.status}")
-                return 'unknown due to connection error: 403'
-            logging.error(f"Failed to fetch the latest version. Status code: {response.status}")
-
-
-async def print_versions(package_key: str, package_name) -> None:
+    url = f"{REPO_API_URL_MAX}/releases/latest"
+    async with session.get(url) as response:
+        if response.status == 200:
+            release_data = await response.json()
+            latest_version = release_data['tag_name']
+            return latest_version
+        if response.status == 403:
+            logging.error(f"Failed to fetch the latest max mod version. "
+                          f"Status code: {response.status}")
+            return 'unknown due to connection error: 403'
+        logging.error(f"Failed to fetch the latest version. Status code: {response.status}")
+
+
+async def print_versions(session: aiohttp.ClientSession, package_key: str,
+                         package_name) -> None:
     """
     Get online version and compare with local.
 
     Parameters
     -------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
     package_key : str
         Type of mod ('CMP' or 'Mods by Max')
     package_name : str
         full name of mod
     """
     local_version = get_local_version(package_key)
-    repo_version = await fetch_cmp_version() if package_key == 'CMP' \
-        else await fetch_max_version()
+    repo_version = await fetch_cmp_version(session) if package_key == 'CMP' \
+        else await fetch_max_version(session)
     msg = (f"Actual version for {package_name} is {repo_version}, local version is"
            f" {'None' if local_version is None else local_version}") + '. '
     if local_version:
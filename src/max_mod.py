@@ -1,13 +1,16 @@
-# pylint: disable=logging-fstring-interpolation
-
+import asyncio
+import functools
 import logging
 import os
+from typing import Callable
 
 import aiohttp
 
 from src.check import delete_empty_folders
-from src.files import download_files, delete_files
-from src.git_functions import fetch_tree_contents
+from src.files import DownloadTask, download_while_scanning, delete_files
+from src.git_functions import fetch_tree_contents, fetch_full_tree, split_tree
+from src.etag_cache import save_etag_cache
+from src.hash_cache import save_manifest
 from src.local_version import save_local_version
 
 # Constants
@@ -20,9 +23,12 @@ RAW_BASE_URL = ('https://raw.githubusercontent.com/DarkMatro/Texture-and-Sounds-
                 '/master')
 RAW_BASE_URL_RU = ('https://raw.githubusercontent.com/DarkMatro/Texture-and-Sounds-mods-by'
                    '-Max_RUS/master')
+# Репозитории в порядке установки, файлы следующего заменяют файлы предыдущего
+REPOS = [(URL, RAW_BASE_URL, FOLDERS_TO_CHECK), (URL_RU, RAW_BASE_URL_RU, FOLDERS_TO_CHECK_RUS)]
 
 
-async def install_max_mod(repo_version: str, is_rus: bool) -> None:
+async def install_max_mod(session: aiohttp.ClientSession, repo_version: str,
+                          is_rus: bool) -> None:
     """
     Install MAX's mods pack files from the repository.
 
@@ -30,73 +36,157 @@ async def install_max_mod(repo_version: str, is_rus: bool) -> None:
 
     Parameters
     ----------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
     repo_version : str
         Actual version from GitHub repository
     is_rus : bool
         Flag to install additional files from folder 'For russian version'
     """
     print('Installing Texture and Sounds mods by Max')
-    async with aiohttp.ClientSession() as session:
-        files_to_download = []
-        for folder in FOLDERS_TO_CHECK:
-            folder_local_path = os.path.join(os.getcwd(), folder)
-            if not os.path.exists(folder_local_path):
-                print(f'Created new folder {folder_local_path}')
-                os.makedirs(folder_local_path)
-            await fetch_tree_contents(URL, session, folder, folder_local_path,
-                                      files_to_download, raw_base_url=RAW_BASE_URL)
-        if is_rus:
-            for folder in FOLDERS_TO_CHECK_RUS:
-                folder_local_path = os.path.join(os.getcwd(), folder)
-                if not os.path.exists(folder_local_path):
-                    print(f'Created new folder {folder_local_path}')
-                    os.makedirs(folder_local_path)
-                await fetch_tree_contents(URL_RU, session, folder, folder_local_path,
-                                          files_to_download, raw_base_url=RAW_BASE_URL_RU)
-
-        if files_to_download:
-            logging.info(f"Downloading {len(files_to_download)} files...")
-            await download_files(session, files_to_download)
-        else:
-            print("No new or updated files to download.")
-            logging.info("No new or updated files to download.")
-
-        save_local_version(repo_version, 'Mods by Max')
-        print(f"Synchronization complete. Max Mods pack is now at version {repo_version}." + '\n')
-        logging.info(f"Synchronization complete. Max Mods pack is now at version {repo_version}.")
-
-
-async def uninstall_max_mod() -> None:
+    repos = REPOS if is_rus else REPOS[:1]
+    # Файлы скачиваются сразу по мере сканирования папок
+    downloaded = await download_while_scanning(
+        session, functools.partial(_scan_repos, session, repos, os.getcwd()))
+
+    if downloaded:
+        logging.info("Downloaded %d files.", downloaded)
+    else:
+        print("No new or updated files to download.")
+        logging.info("No new or updated files to download.")
+
+    save_local_version(repo_version, 'Mods by Max')
+    save_manifest()
+    save_etag_cache()
+    print(f"Synchronization complete. Max Mods pack is now at version {repo_version}." + '\n')
+    logging.info("Synchronization complete. Max Mods pack is now at version %s.", repo_version)
+
+
+async def uninstall_max_mod(session: aiohttp.ClientSession) -> None:
     """
     Uninstall Max mod pack files.
 
     This function checks and deletes all files from game folder equal to files from repository.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
     """
     print('Uninstalling Texture and Sounds mods by Max')
-    async with aiohttp.ClientSession() as session:
-        files_to_delete = []
-        for folder in FOLDERS_TO_CHECK:
-            folder_local_path = os.path.join(os.getcwd(), folder)
-            if not os.path.exists(folder_local_path):
+    base = os.getcwd()
+    trees = await asyncio.gather(*(fetch_full_tree(session, url) for url, _, _ in REPOS))
+    tasks = []
+    for (url, _, folders), tree in zip(REPOS, trees):
+        sub_trees = split_tree(tree, folders)
+        for folder in folders:
+            folder_local_path = os.path.join(base, folder)
+            if not os.path.isdir(folder_local_path):
                 continue
-            await fetch_tree_contents(URL, session, folder, folder_local_path, files_to_delete,
-                                      is_delete=True)
-        for folder in FOLDERS_TO_CHECK_RUS:
-            folder_local_path = os.path.join(os.getcwd(), folder)
-            if not os.path.exists(folder_local_path):
+            tasks.append(_plan_folder(session, url, folder, folder_local_path,
+                                      sub_trees[folder]))
+    # Файл из обоих репозиториев совпадает только с одним из них, но удаляется один раз
+    files_to_delete = list({file_info['local_path']: file_info
+                            for files in await asyncio.gather(*tasks)
+                            for file_info in files}.values())
+    if files_to_delete:
+        logging.info("Deleting %d files...", len(files_to_delete))
+        await delete_files(files_to_delete)
+        save_local_version(None)
+        msg = "Mods pack uninstalled."
+        print(msg + '\n')
+        logging.info(msg)
+    else:
+        print("No files to delete.")
+        logging.info("No files to delete.")
+    save_manifest()
+    save_etag_cache()
+    # Папки обходятся параллельно в пуле потоков, общие для обоих репозиториев - один раз
+    folder_local_paths = [os.path.join(base, folder)
+                          for folder in dict.fromkeys(folder for _, _, folders in REPOS
+                                                      for folder in folders)]
+    await asyncio.gather(*(asyncio.to_thread(delete_empty_folders, folder_local_path)
+                           for folder_local_path in folder_local_paths
+                           if os.path.isdir(folder_local_path)))
+
+
+async def _scan_repos(session: aiohttp.ClientSession, repos: list, base: str,
+                      add_file: Callable[[DownloadTask], None]) -> None:
+    """
+    Scan folders of the repositories concurrently for files to download.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
+    repos : list
+        of (tree URL, raw URL, folders) from REPOS.
+    base : str
+        The game folder.
+    add_file : Callable
+        Called with DownloadTask of every new or changed file.
+    """
+    # Дерево каждого репозитория запрашивается один раз, без изменений GitHub отвечает 304
+    trees = await asyncio.gather(*(fetch_full_tree(session, url) for url, _, _ in repos))
+    sub_trees_by_repo = [split_tree(tree, folders) for (_, _, folders), tree in zip(repos, trees)]
+    _drop_overridden(sub_trees_by_repo)
+    tasks = []
+    for (url, raw_base_url, folders), sub_trees in zip(repos, sub_trees_by_repo):
+        for folder in folders:
+            folder_local_path = os.path.join(base, folder)
+            os.makedirs(folder_local_path, exist_ok=True)
+            tasks.append(fetch_tree_contents(url, session, folder, folder_local_path, add_file,
+                                             raw_base_url=raw_base_url, tree=sub_trees[folder]))
+    # Папки сканируются одновременно
+    await asyncio.gather(*tasks)
+
+
+def _drop_overridden(sub_trees_by_repo: list) -> None:
+    """
+    Remove files that are also shipped by a later repository from the trees of the earlier ones,
+    so such files are downloaded once and the later repository wins.
+
+    Parameters
+    ----------
+    sub_trees_by_repo : list
+        of folder -> tree dicts from split_tree in the order of REPOS, changed in place.
+        Folders with unknown tree (None) are left as is.
+    """
+    later_paths = set()
+    for sub_trees in reversed(sub_trees_by_repo):
+        for folder, tree in sub_trees.items():
+            if tree is None:
                 continue
-            await fetch_tree_contents(URL_RU, session, folder, folder_local_path, files_to_delete,
-                                      is_delete=True)
-        if files_to_delete:
-            logging.info(f"Deleting {len(files_to_delete)} files...")
-            await delete_files(files_to_delete)
-            save_local_version(None)
-            msg = "Mods pack uninstalled."
-            print(msg + '\n')
-            logging.info(msg)
-        else:
-            print("No files to delete.")
-            logging.info("No files to delete.")
-    for folder in FOLDERS_TO_CHECK:
-        folder_local_path = os.path.join(os.getcwd(), folder)
-        delete_empty_folders(folder_local_path)
+            paths = {f"{folder}/{item['path']}" for item in tree['tree'] if item['type'] == 'blob'}
+            tree['tree'] = [item for item in tree['tree']
+                            if f"{folder}/{item['path']}" not in later_paths]
+            later_paths |= paths
+
+
+async def _plan_folder(session: aiohttp.ClientSession, url: str, folder: str,
+                       folder_local_path: str, tree: dict | None) -> list:
+    """
+    Scan one folder of the repository into its own list of files to delete.
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        The active client session for making HTTP requests.
+    url : str
+        of the repository tree like URL or URL_RU.
+    folder : str
+        Folder name.
+    folder_local_path : str
+        The local path of the folder.
+    tree : dict or None
+        Tree of the folder from split_tree. The tree of the folder is requested if None.
+
+    Returns
+    -------
+    list
+        of dictionaries containing the local path and size.
+    """
+    files = []
+    await fetch_tree_contents(url, session, folder, folder_local_path, files.append,
+                              is_delete=True, tree=tree)
+    return files